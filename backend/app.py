@@ -1,8 +1,13 @@
 import os
+import json
+import time
+import threading
 import whisper
 import uuid
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify, redirect, url_for, current_app, send_from_directory
+import mimetypes
+import click
+from datetime import datetime, timedelta
+from flask import Flask, render_template, request, jsonify, redirect, url_for, current_app, send_from_directory, Response, stream_with_context
 from flask_pymongo import PyMongo
 from flask_login import LoginManager, login_required, current_user
 from werkzeug.security import generate_password_hash
@@ -10,6 +15,7 @@ from bson.objectid import ObjectId
 
 from auth import auth, init_auth
 from models import Doctor, Patient
+import archive
 import os
 from flask import Flask
 
@@ -49,8 +55,46 @@ def format_time(value):
     except ValueError:
         return value
 
-# Load Whisper (kept from original)
-model = whisper.load_model("small")
+# Whisper tiers: a fast draft model and a slower, more accurate refine model
+DRAFT_MODEL = os.environ.get("WHISPER_DRAFT_MODEL", "base")
+REFINE_MODEL = os.environ.get("WHISPER_MODEL", "small")
+# Models a client may ask for as refine_model; anything else would be downloaded and kept in RAM
+REFINE_MODELS = [m.strip() for m in os.environ.get("WHISPER_REFINE_MODELS", REFINE_MODEL).split(",") if m.strip()]
+# Drafts still unrefined after this long are treated as failed (e.g. lost in a restart)
+REFINE_TIMEOUT_MINUTES = int(os.environ.get("WHISPER_REFINE_TIMEOUT_MINUTES", 15))
+
+_models = {}
+_model_locks = {}
+_models_lock = threading.Lock()
+
+def get_model(name):
+    """Loads a Whisper model once and returns it with the lock guarding its use."""
+    # The global lock only hands out per-model locks, so loading one model
+    # does not hold up transcriptions on the others
+    with _models_lock:
+        lock = _model_locks.setdefault(name, threading.Lock())
+    with lock:
+        if name not in _models:
+            _models[name] = whisper.load_model(name)
+    return _models[name], lock
+
+def run_transcribe_timed(name, audio, **kwargs):
+    """Transcribes and returns (result, inference seconds, seconds spent waiting for the model)."""
+    queued = time.perf_counter()
+    model, lock = get_model(name)
+    # Whisper installs decoding hooks on the model per call, so one call at a time per model
+    with lock:
+        started = time.perf_counter()
+        result = model.transcribe(audio, language="en", fp16=False, **kwargs) # Disable fp16 for CPU safety
+        finished = time.perf_counter()
+    return result, round(finished - started, 3), round(started - queued, 3)
+
+def run_transcribe(name, audio, **kwargs):
+    return run_transcribe_timed(name, audio, **kwargs)[0]
+
+# Load Whisper (kept from original); both tiers up front so no request pays for loading
+get_model(REFINE_MODEL)
+get_model(DRAFT_MODEL)
 
 # CLI Command to create initial doctor
 @app.cli.command("create-doctor")
@@ -68,6 +112,13 @@ def create_doctor():
     Doctor.create_user(app.mongo, username, hashed, email)
     print(f"Doctor {username} created successfully.")
 
+@app.cli.command("archive")
+@click.option("--days", default=archive.ARCHIVE_AGE_DAYS, show_default=True,
+              help="Archive consultations and uploads older than this many days.")
+def archive_old_records(days):
+    """Moves old consultations and uploads into compressed cold storage."""
+    archive.run_archival(app.mongo, app.config['UPLOAD_FOLDER'], days)
+
 @app.route("/")
 def index():
     if current_user.is_authenticated:
@@ -104,8 +155,24 @@ def patient_view(pid):
     patient = Patient.get_by_id(app.mongo, pid)
     if not patient:
         return "Patient not found", 404
+    for f in patient.get('files', []):
+        if f.get('archived'):
+            f['url'] = url_for('archived_file', pid=pid, filename=f['filename'])
     return render_template("patient_profile.html", patient=patient)
 
+@app.route("/patients/<pid>/files/<filename>")
+@login_required
+def archived_file(pid, filename):
+    # Only the one files entry; loading the patient would rehydrate every archived consultation
+    entry = Patient.get_file(app.mongo, pid, filename)
+    if not entry or not entry.get('archived'):
+        return "File not found", 404
+    stream = archive.open_archived_file(filename)
+    if stream is None:
+        return "File not found", 404
+    mimetype = mimetypes.guess_type(entry.get('original_name') or filename)[0] or 'application/octet-stream'
+    return Response(stream, mimetype=mimetype)
+
 @app.route("/patients/<pid>/consultation", methods=["POST"])
 @login_required
 def add_consultation(pid):
@@ -122,9 +189,29 @@ def add_consultation(pid):
 @app.route("/patients/<pid>/consultation/<cid>/delete", methods=["POST"])
 @login_required
 def delete_consultation(pid, cid):
-    Patient.delete_consultation(app.mongo, pid, cid)
+    try:
+        Patient.delete_consultation(app.mongo, pid, cid)
+    except Exception:
+        import traceback
+        traceback.print_exc()
+        return "Could not delete the archived consultation. Nothing was removed; please try again.", 503
     return redirect(url_for("patient_view", pid=pid, tab='consultation'))
 
+@app.route("/patients/<pid>/consultation/<cid>", methods=["GET"])
+@login_required
+def get_consultation(pid, cid):
+    consultation = Patient.get_consultation(app.mongo, pid, cid)
+    if not consultation:
+        return jsonify({"error": "Consultation not found"}), 404
+    transcription = consultation.get("transcription") or {}
+    if transcription.get("status") == "draft" and consultation["date"] < stale_draft_cutoff():
+        Patient.update_consultation(app.mongo, pid, cid, {
+            "transcription.status": "failed",
+            "transcription.error": "Refinement did not finish",
+        }, match={"transcription.status": "draft"})
+        consultation = Patient.get_consultation(app.mongo, pid, cid) or consultation
+    return jsonify(consultation)
+
 @app.route("/patients/<pid>/upload", methods=["POST"])
 @login_required
 def upload_file_route(pid):
@@ -146,6 +233,161 @@ def upload_file_route(pid):
         
     return redirect(url_for("patient_view", pid=pid))
 
+def save_and_convert(audio_file):
+    """Saves an uploaded audio file and converts it to 16kHz mono WAV.
+
+    Returns (input_path, output_path, error, status). On failure `error` holds
+    the message and `status` the HTTP code; the caller must clean up both paths.
+    """
+    unique_id = uuid.uuid4().hex
+    input_filename = f"temp_input_{unique_id}_{audio_file.filename}"
+    output_filename = f"temp_output_{unique_id}.wav"
+
+    input_path = os.path.join(app.config['UPLOAD_FOLDER'], input_filename)
+    output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+
+    audio_file.save(input_path)
+
+    if not os.path.exists(input_path) or os.path.getsize(input_path) < 100:
+         print(f"DEBUG: Saved file is too small: {os.path.getsize(input_path)} bytes")
+         return input_path, output_path, "File save failed or empty file. Size < 100 bytes", 400
+
+    # Use subprocess to capture ffmpeg output and ensure it runs
+    import subprocess
+    command = [
+        'ffmpeg', '-y', 
+        '-i', input_path, 
+        '-ar', '16000', 
+        '-ac', '1', 
+        '-c:a', 'pcm_s16le', 
+        output_path
+    ]
+    
+    print(f"DEBUG: Running ffmpeg: {' '.join(command)}")
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, check=True)
+        print("DEBUG: ffmpeg stdout:", result.stdout)
+        print("DEBUG: ffmpeg stderr:", result.stderr)
+    except subprocess.CalledProcessError as e:
+        print("ERROR: ffmpeg failed")
+        print("STDOUT:", e.stdout)
+        print("STDERR:", e.stderr)
+        return input_path, output_path, f"Audio processing failed: {e.stderr}", 500
+    except FileNotFoundError:
+        return input_path, output_path, "ffmpeg not found on server. Please install ffmpeg.", 500
+
+    if not os.path.exists(output_path) or os.path.getsize(output_path) < 100:
+         print(f"DEBUG: Output WAV too small: {os.path.getsize(output_path) if os.path.exists(output_path) else 'Missing'}")
+         return input_path, output_path, "Converted audio file is empty or corrupted", 500
+
+    return input_path, output_path, None, 200
+
+def cleanup_files(*paths):
+    for path in paths:
+        if path and os.path.exists(path):
+            try: os.remove(path)
+            except: pass
+
+def _decode_window(model, mel_segment, prompt):
+    """Decodes one 30s mel window with Whisper's default temperature fallback."""
+    from whisper.decoding import DecodingOptions
+    result = None
+    for temperature in (0.0, 0.2, 0.4, 0.6, 0.8, 1.0):
+        options = DecodingOptions(language="en", task="transcribe", temperature=temperature,
+                                  prompt=prompt, fp16=False)
+        result = model.decode(mel_segment, options)
+        too_repetitive = result.compression_ratio > 2.4
+        too_unlikely = result.avg_logprob < -1.0
+        silent = result.no_speech_prob > 0.6 and too_unlikely
+        if silent or not (too_repetitive or too_unlikely):
+            break
+    return result
+
+def iter_segments(wav_path):
+    """Yields Whisper segments with absolute start/end times as each 30s window is decoded.
+
+    `transcribe` only returns once the whole file is done, so this runs the
+    same loop one window at a time: each window is decoded once, and the next
+    window starts at the last complete timestamp, so a segment cut at the
+    window edge is decoded again with the audio that follows it.
+    """
+    import torch
+    from whisper.audio import N_FRAMES, HOP_LENGTH, SAMPLE_RATE, log_mel_spectrogram, pad_or_trim
+    from whisper.tokenizer import get_tokenizer
+
+    model, lock = get_model(REFINE_MODEL)
+    tokenizer = get_tokenizer(model.is_multilingual, num_languages=model.num_languages,
+                              language="en", task="transcribe")
+    # Pad 30s of silence to the input audio, for slicing
+    mel = log_mel_spectrogram(whisper.load_audio(wav_path), model.dims.n_mels, padding=whisper.audio.N_SAMPLES)
+    content_frames = mel.shape[-1] - N_FRAMES
+    input_stride = N_FRAMES // model.dims.n_audio_ctx
+    time_precision = input_stride * HOP_LENGTH / SAMPLE_RATE
+    max_prompt = model.dims.n_text_ctx // 2 - 1
+
+    all_tokens = []
+    seek = 0
+    while seek < content_frames:
+        time_offset = seek * HOP_LENGTH / SAMPLE_RATE
+        segment_size = min(N_FRAMES, content_frames - seek)
+        mel_segment = pad_or_trim(mel[:, seek:seek + segment_size], N_FRAMES).to(model.device)
+
+        # Hold the model only per window so other requests can interleave with a long stream
+        with lock:
+            result = _decode_window(model, mel_segment, all_tokens[-max_prompt:])
+        tokens = torch.tensor(result.tokens)
+
+        if result.no_speech_prob > 0.6 and result.avg_logprob < -1.0:
+            seek += segment_size
+            continue
+
+        timestamp_tokens = tokens.ge(tokenizer.timestamp_begin)
+        single_timestamp_ending = timestamp_tokens[-2:].tolist() == [False, True]
+        consecutive = (torch.where(timestamp_tokens[:-1] & timestamp_tokens[1:])[0] + 1).tolist()
+
+        segments = []
+        if consecutive:
+            if single_timestamp_ending:
+                consecutive.append(len(tokens))
+            last_slice = 0
+            for current_slice in consecutive:
+                sliced = tokens[last_slice:current_slice]
+                segments.append((
+                    sliced[0].item() - tokenizer.timestamp_begin,
+                    sliced[-1].item() - tokenizer.timestamp_begin,
+                    sliced,
+                ))
+                last_slice = current_slice
+            if single_timestamp_ending:
+                # No speech after the last timestamp
+                advance = segment_size
+            else:
+                # Drop the unfinished segment and seek to the last complete timestamp
+                advance = (tokens[last_slice - 1].item() - tokenizer.timestamp_begin) * input_stride
+        else:
+            end = segment_size * HOP_LENGTH / SAMPLE_RATE / time_precision
+            timestamps = tokens[timestamp_tokens.nonzero().flatten()]
+            if len(timestamps) > 0 and timestamps[-1].item() != tokenizer.timestamp_begin:
+                end = timestamps[-1].item() - tokenizer.timestamp_begin
+            segments.append((0, end, tokens))
+            advance = segment_size
+        seek += advance if advance > 0 else segment_size
+
+        for start, end, sliced in segments:
+            text_tokens = [t for t in sliced.tolist() if t < tokenizer.eot]
+            all_tokens.extend(text_tokens)
+            text = tokenizer.decode(text_tokens).strip()
+            if not text:
+                continue
+            yield {
+                "start": round(time_offset + start * time_precision, 2),
+                "end": round(time_offset + end * time_precision, 2),
+                "text": text,
+            }
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @app.route("/transscribe", methods=["POST"])
 def transcribe():
     if "audio" not in request.files:
@@ -155,50 +397,14 @@ def transcribe():
     if audio_file.filename == '':
         return jsonify({"error": "Empty filename"}), 400
 
-    unique_id = uuid.uuid4().hex
-    input_filename = f"temp_input_{unique_id}_{audio_file.filename}"
-    output_filename = f"temp_output_{unique_id}.wav"
-    
-    input_path = os.path.join(app.config['UPLOAD_FOLDER'], input_filename)
-    output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-
+    input_path = output_path = None
     try:
-        audio_file.save(input_path)
-        
-        if not os.path.exists(input_path) or os.path.getsize(input_path) < 100:
-             print(f"DEBUG: Saved file is too small: {os.path.getsize(input_path)} bytes")
-             return jsonify({"error": "File save failed or empty file. Size < 100 bytes"}), 400
-
-        # Use subprocess to capture ffmpeg output and ensure it runs
-        import subprocess
-        command = [
-            'ffmpeg', '-y', 
-            '-i', input_path, 
-            '-ar', '16000', 
-            '-ac', '1', 
-            '-c:a', 'pcm_s16le', 
-            output_path
-        ]
-        
-        print(f"DEBUG: Running ffmpeg: {' '.join(command)}")
-        try:
-            result = subprocess.run(command, capture_output=True, text=True, check=True)
-            print("DEBUG: ffmpeg stdout:", result.stdout)
-            print("DEBUG: ffmpeg stderr:", result.stderr)
-        except subprocess.CalledProcessError as e:
-            print("ERROR: ffmpeg failed")
-            print("STDOUT:", e.stdout)
-            print("STDERR:", e.stderr)
-            return jsonify({"error": f"Audio processing failed: {e.stderr}"}), 500
-        except FileNotFoundError:
-            return jsonify({"error": "ffmpeg not found on server. Please install ffmpeg."}), 500
-
-        if not os.path.exists(output_path) or os.path.getsize(output_path) < 100:
-             print(f"DEBUG: Output WAV too small: {os.path.getsize(output_path) if os.path.exists(output_path) else 'Missing'}")
-             return jsonify({"error": "Converted audio file is empty or corrupted"}), 500
+        input_path, output_path, error, status = save_and_convert(audio_file)
+        if error:
+            return jsonify({"error": error}), status
 
         print(f"DEBUG: Transcription starting for {output_path}")
-        result = model.transcribe(output_path, language="en", fp16=False) # Disable fp16 for CPU safety
+        result = run_transcribe(REFINE_MODEL, output_path)
         text = result.get("text", "").strip()
         print(f"DEBUG: Transcription result: {text[:50]}...")
 
@@ -210,12 +416,182 @@ def transcribe():
         return jsonify({"error": f"Server Error: {str(e)}"}), 500
     finally:
         # Cleanup
-        if os.path.exists(input_path):
-            try: os.remove(input_path)
-            except: pass
-        if os.path.exists(output_path):
-            try: os.remove(output_path)
-            except: pass
+        cleanup_files(input_path, output_path)
+
+@app.route("/transscribe/stream", methods=["POST"])
+@login_required
+def transcribe_stream():
+    """Streams transcript segments as Server-Sent Events while Whisper decodes.
+
+    Emits one `segment` event per decoded segment, then a `done` event with the
+    full text, which is also saved as a consultation when `patient_id` is given.
+    """
+    if "audio" not in request.files:
+        return jsonify({"error": "No audio file provided"}), 400
+
+    audio_file = request.files["audio"]
+    if audio_file.filename == '':
+        return jsonify({"error": "Empty filename"}), 400
+
+    patient_id = request.form.get("patient_id")
+
+    input_path = output_path = None
+    try:
+        input_path, output_path, error, status = save_and_convert(audio_file)
+    except Exception as e:
+        cleanup_files(input_path, output_path)
+        return jsonify({"error": f"Server Error: {str(e)}"}), 500
+    if error:
+        cleanup_files(input_path, output_path)
+        return jsonify({"error": error}), status
+
+    def generate():
+        try:
+            print(f"DEBUG: Streaming transcription starting for {output_path}")
+            texts = []
+            for segment in iter_segments(output_path):
+                texts.append(segment["text"])
+                yield sse_event("segment", segment)
+
+            text = " ".join(texts)
+            consultation_id = None
+            if patient_id and text:
+                consultation_id = uuid.uuid4().hex
+                Patient.add_consultation(app.mongo, patient_id, {
+                    "id": consultation_id,
+                    "text": text,
+                    "date": datetime.now().isoformat(),
+                    "doctor": current_user.username
+                })
+            yield sse_event("done", {"text": text, "consultation_id": consultation_id})
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            yield sse_event("error", {"error": f"Server Error: {str(e)}"})
+        finally:
+            cleanup_files(input_path, output_path)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+
+def stale_draft_cutoff():
+    return (datetime.now() - timedelta(minutes=REFINE_TIMEOUT_MINUTES)).isoformat()
+
+def refine_consultation(patient_id, consultation_id, model_name, wav_path):
+    """Re-transcribes with the refine model and replaces the draft text on the consultation.
+
+    Only a consultation still in `draft` is updated: once a draft has timed out
+    as failed, a late refine result is discarded so the client's view holds.
+    """
+    still_draft = {"transcription.status": "draft"}
+    try:
+        result, latency, queue_wait = run_transcribe_timed(model_name, wav_path)
+        text = result.get("text", "").strip()
+        print(f"DEBUG: Refine ({model_name}) took {latency}s after {queue_wait}s queued for consultation {consultation_id}")
+
+        update = {
+            "transcription.status": "refined",
+            "transcription.refine_latency": latency,
+            "transcription.refine_queue_wait": queue_wait,
+            "transcription.refined_at": datetime.now().isoformat(),
+        }
+        if text:
+            update["text"] = text
+        updated = Patient.update_consultation(app.mongo, patient_id, consultation_id, update, match=still_draft)
+        if not updated.modified_count:
+            print(f"DEBUG: Discarding late refine for consultation {consultation_id}; no longer a draft")
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        Patient.update_consultation(app.mongo, patient_id, consultation_id, {
+            "transcription.status": "failed",
+            "transcription.error": str(e),
+        }, match=still_draft)
+    finally:
+        cleanup_files(wav_path)
+
+@app.route("/transscribe/tiered", methods=["POST"])
+@login_required
+def transcribe_tiered():
+    """Returns a fast draft transcript, then refines it in the background.
+
+    The draft is saved as a consultation straight away; a background thread
+    re-runs the audio through the refine model and replaces the text. Progress
+    and both latencies are kept under the consultation's `transcription` field.
+    """
+    if "audio" not in request.files:
+        return jsonify({"error": "No audio file provided"}), 400
+
+    audio_file = request.files["audio"]
+    if audio_file.filename == '':
+        return jsonify({"error": "Empty filename"}), 400
+
+    patient_id = request.form.get("patient_id")
+    if not patient_id:
+        return jsonify({"error": "No patient_id provided"}), 400
+
+    refine_model = request.form.get("refine_model") or REFINE_MODEL
+    if refine_model not in REFINE_MODELS:
+        return jsonify({"error": f"Refine model not allowed: {refine_model}"}), 400
+
+    input_path = output_path = None
+    refining = False
+    try:
+        input_path, output_path, error, status = save_and_convert(audio_file)
+        if error:
+            return jsonify({"error": error}), status
+
+        result, draft_latency, draft_queue_wait = run_transcribe_timed(DRAFT_MODEL, output_path)
+        text = result.get("text", "").strip()
+        print(f"DEBUG: Draft ({DRAFT_MODEL}) took {draft_latency}s after {draft_queue_wait}s queued: {text[:50]}...")
+
+        consultation_id = uuid.uuid4().hex
+        Patient.add_consultation(app.mongo, patient_id, {
+            "id": consultation_id,
+            "text": text,
+            "date": datetime.now().isoformat(),
+            "doctor": current_user.username,
+            "transcription": {
+                "status": "draft",
+                "draft_text": text,
+                "draft_model": DRAFT_MODEL,
+                "draft_latency": draft_latency,
+                "draft_queue_wait": draft_queue_wait,
+                "refine_model": refine_model,
+                "refine_latency": None,
+                "refine_queue_wait": None,
+            }
+        })
+
+        threading.Thread(
+            target=refine_consultation,
+            args=(patient_id, consultation_id, refine_model, output_path),
+            daemon=True,
+        ).start()
+        refining = True
+
+        return jsonify({
+            "text": text,
+            "consultation_id": consultation_id,
+            "status": "draft",
+            "draft_latency": draft_latency,
+        })
+
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"Server Error: {str(e)}"}), 500
+    finally:
+        # The refine thread owns the converted WAV once started
+        cleanup_files(input_path)
+        if not refining:
+            cleanup_files(output_path)
 
 if __name__ == "__main__":
+    # The debug reloader runs this block in a watcher process too; only the serving child sets WERKZEUG_RUN_MAIN
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        # Refine threads do not survive a restart; fail their drafts so clients stop waiting
+        Patient.fail_stale_drafts(app.mongo, stale_draft_cutoff(), "Refinement did not finish")
+        # Periodic archival, enabled by setting ARCHIVE_INTERVAL_HOURS
+        archive.start_archiver(app.mongo, UPLOAD_FOLDER)
     app.run(debug=True)
\ No newline at end of file
@@ -2,9 +2,15 @@ import motor.motor_asyncio
 import os
 
 MONGO_DETAILS = os.getenv("MONGO_DETAILS", "mongodb://localhost:27017")
+MONGO_DB = os.getenv("MONGO_DB", "clinical_system")
 
-client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_DETAILS)
-database = client.clinical_system
+if MONGO_DETAILS.startswith("mongomock://"):
+    # In-memory stand-in for load tests and local runs without a mongod
+    from mongomock_motor import AsyncMongoMockClient
+    client = AsyncMongoMockClient()
+else:
+    client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_DETAILS)
+database = client[MONGO_DB]
 
 doctor_collection = database.get_collection("doctors")
 patient_collection = database.get_collection("patients")
@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException
-from typing import List
+from typing import List, Optional
 from ..database import patient_collection
 from ..models import PatientModel, PatientResponse, PatientUpdateModel
 from ..auth import get_current_user
 from bson import ObjectId
+import re
 
 router = APIRouter()
 
@@ -19,12 +20,15 @@ def patient_helper(patient) -> dict:
     }
 
 @router.get("/", response_model=List[PatientResponse])
-async def get_patients(current_user: dict = Depends(get_current_user)):
+async def get_patients(search: Optional[str] = None, current_user: dict = Depends(get_current_user)):
     patients = []
     # Only show patients for this doctor
     # current_user is the doctor dict from DB
     doctor_id = str(current_user["_id"])
-    async for patient in patient_collection.find({"doctor_id": doctor_id}):
+    query = {"doctor_id": doctor_id}
+    if search:
+        query["name"] = {"$regex": re.escape(search), "$options": "i"}
+    async for patient in patient_collection.find(query):
         patients.append(patient_helper(patient))
     return patients
 
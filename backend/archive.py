@@ -0,0 +1,281 @@
+import os
+import json
+import uuid
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import zstandard as zstd
+
+# Cold storage for old consultations and uploaded files
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", os.path.join(os.path.dirname(__file__), "cold_storage"))
+ARCHIVE_AGE_DAYS = int(os.environ.get("ARCHIVE_AGE_DAYS", 365))
+ARCHIVE_INTERVAL_HOURS = float(os.environ.get("ARCHIVE_INTERVAL_HOURS", 0))
+CHUNK_RECORDS = int(os.environ.get("ARCHIVE_CHUNK_RECORDS", 500))
+CACHE_RECORDS = int(os.environ.get("ARCHIVE_CACHE_RECORDS", 1024))
+COMPRESSION_LEVEL = 10
+STREAM_BLOCK = 64 * 1024
+# Lock files older than this are assumed to belong to a crashed process
+RUN_LOCK_STALE_SECONDS = 6 * 3600
+CHUNK_LOCK_STALE_SECONDS = 60
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _consultation_dir():
+    path = os.path.join(ARCHIVE_DIR, "consultations")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _file_dir():
+    path = os.path.join(ARCHIVE_DIR, "files")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _chunk_path(chunk_id):
+    return os.path.join(_consultation_dir(), f"{chunk_id}.json.zst")
+
+def _write_atomic(path, write):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as fh:
+        write(fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+def _acquire_lock(name, stale_after, wait=0.0):
+    """Creates ARCHIVE_DIR/<name>.lock exclusively; returns its path, or None if another process holds it."""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_DIR, f"{name}.lock")
+    deadline = time.time() + wait
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > stale_after:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.time() >= deadline:
+                return None
+            time.sleep(0.1)
+            continue
+        os.write(fd, str(os.getpid()).encode("ascii"))
+        os.close(fd)
+        return path
+
+def _release_lock(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _write_chunk(records):
+    chunk_id = f"{datetime.now():%Y%m%d%H%M%S}_{uuid.uuid4().hex[:8]}"
+    data = json.dumps({r["id"]: r for r in records}, default=str).encode("utf-8")
+    compressed = zstd.ZstdCompressor(level=COMPRESSION_LEVEL).compress(data)
+    _write_atomic(_chunk_path(chunk_id), lambda fh: fh.write(compressed))
+    return chunk_id
+
+def _read_chunk(chunk_id):
+    with open(_chunk_path(chunk_id), "rb") as fh:
+        return json.loads(zstd.ZstdDecompressor().decompress(fh.read()))
+
+def _purge_records(chunk_id, ids):
+    """Removes records from a chunk and the cache, deleting the chunk once it is empty."""
+    lock = _acquire_lock(f"chunk_{chunk_id}", CHUNK_LOCK_STALE_SECONDS, wait=10)
+    if lock is None:
+        raise RuntimeError(f"Archive chunk {chunk_id} is locked")
+    try:
+        path = _chunk_path(chunk_id)
+        if os.path.exists(path):
+            records = _read_chunk(chunk_id)
+            for cid in ids:
+                records.pop(cid, None)
+            if records:
+                data = json.dumps(records, default=str).encode("utf-8")
+                compressed = zstd.ZstdCompressor(level=COMPRESSION_LEVEL).compress(data)
+                _write_atomic(path, lambda fh: fh.write(compressed))
+            else:
+                os.remove(path)
+    finally:
+        _release_lock(lock)
+    with _cache_lock:
+        for cid in ids:
+            _cache.pop((chunk_id, cid), None)
+
+def delete_record(stub):
+    """Permanently removes the archived record behind a consultation stub."""
+    _purge_records(stub["archived"]["chunk"], [stub["id"]])
+
+def _cache_get(key):
+    with _cache_lock:
+        record = _cache.get(key)
+        if record is not None:
+            _cache.move_to_end(key)
+        return record
+
+def _cache_put(key, record):
+    with _cache_lock:
+        _cache[key] = record
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_RECORDS:
+            _cache.popitem(last=False)
+
+def rehydrate(consultations):
+    """Replaces archive stubs with their full records, decompressing each chunk at most once."""
+    missing = {}
+    for c in consultations:
+        stub = c.get("archived")
+        if stub and _cache_get((stub["chunk"], c["id"])) is None:
+            missing.setdefault(stub["chunk"], []).append(c["id"])
+
+    for chunk_id, ids in missing.items():
+        try:
+            records = _read_chunk(chunk_id)
+        except (OSError, ValueError, zstd.ZstdError) as e:
+            print(f"ERROR: Could not read archive chunk {chunk_id}: {e}")
+            continue
+        for cid in ids:
+            if cid in records:
+                _cache_put((chunk_id, cid), records[cid])
+
+    result = []
+    for c in consultations:
+        stub = c.get("archived")
+        record = _cache_get((stub["chunk"], c["id"])) if stub else None
+        # Hand out copies so callers cannot mutate the cached record
+        result.append(dict(record) if record is not None else c)
+    return result
+
+def archive_consultations(mongo, older_than_days=ARCHIVE_AGE_DAYS):
+    """Moves consultations older than the cutoff into compressed chunks, leaving stubs.
+
+    Chunks are written and synced before any stub replaces its record, so an
+    interrupted run leaves at worst an unreferenced chunk on disk.
+    """
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat()
+    patients = mongo.db.patients.find(
+        {"consultations": {"$elemMatch": {"date": {"$lt": cutoff}, "archived": {"$exists": False}}}},
+        {"consultations": 1}
+    )
+
+    pending = []
+    archived = 0
+
+    def flush():
+        chunk_id = _write_chunk([c for _, c in pending])
+        changed = []
+        for patient_id, c in pending:
+            # Only replace the element if it still holds what was written to the chunk
+            result = mongo.db.patients.update_one(
+                {"_id": patient_id, "consultations": {"$elemMatch": {
+                    "id": c["id"],
+                    "text": c.get("text"),
+                    "transcription.status": (c.get("transcription") or {}).get("status"),
+                    "archived": {"$exists": False},
+                }}},
+                {"$set": {"consultations.$": {
+                    "id": c["id"],
+                    "date": c.get("date"),
+                    "doctor": c.get("doctor"),
+                    "archived": {"chunk": chunk_id},
+                }}}
+            )
+            if not result.modified_count:
+                changed.append(c["id"])
+        # Records edited or deleted since the scan stay hot; drop their stale copies
+        if changed:
+            _purge_records(chunk_id, changed)
+        return len(pending) - len(changed)
+
+    for patient in patients:
+        for c in patient.get("consultations", []):
+            if "id" not in c or c.get("archived") or not c.get("date") or c["date"] >= cutoff:
+                continue
+            if (c.get("transcription") or {}).get("status") == "draft":
+                continue
+            pending.append((patient["_id"], c))
+            if len(pending) >= CHUNK_RECORDS:
+                archived += flush()
+                pending = []
+    if pending:
+        archived += flush()
+    return archived
+
+def archive_files(mongo, upload_folder, older_than_days=ARCHIVE_AGE_DAYS):
+    """Compresses uploads older than the cutoff into cold storage and removes the originals."""
+    cutoff = time.time() - older_than_days * 86400
+    patients = mongo.db.patients.find(
+        {"files": {"$elemMatch": {"archived": {"$exists": False}}}},
+        {"files": 1}
+    )
+
+    archived = 0
+    for patient in patients:
+        for f in patient.get("files", []):
+            if f.get("archived"):
+                continue
+            source = os.path.join(upload_folder, f["filename"])
+            if not os.path.exists(source) or os.path.getmtime(source) >= cutoff:
+                continue
+
+            target = os.path.join(_file_dir(), f"{f['filename']}.zst")
+            with open(source, "rb") as src:
+                _write_atomic(target, lambda fh: zstd.ZstdCompressor(level=COMPRESSION_LEVEL).copy_stream(src, fh))
+            mongo.db.patients.update_one(
+                {"_id": patient["_id"], "files.filename": f["filename"]},
+                {"$set": {"files.$.archived": True}}
+            )
+            os.remove(source)
+            archived += 1
+    return archived
+
+def open_archived_file(filename):
+    """Returns a generator of the decompressed upload, block by block, or None if not archived."""
+    path = os.path.join(_file_dir(), f"{os.path.basename(filename)}.zst")
+    if not os.path.exists(path):
+        return None
+
+    def generate():
+        with open(path, "rb") as fh, zstd.ZstdDecompressor().stream_reader(fh) as reader:
+            while True:
+                block = reader.read(STREAM_BLOCK)
+                if not block:
+                    break
+                yield block
+    return generate()
+
+def run_archival(mongo, upload_folder, older_than_days=ARCHIVE_AGE_DAYS):
+    # One run at a time across threads, workers and the CLI
+    lock = _acquire_lock("archival", RUN_LOCK_STALE_SECONDS)
+    if lock is None:
+        print("Archival already running; skipping.")
+        return 0, 0
+    try:
+        consultations = archive_consultations(mongo, older_than_days)
+        files = archive_files(mongo, upload_folder, older_than_days)
+    finally:
+        _release_lock(lock)
+    print(f"Archived {consultations} consultations and {files} files older than {older_than_days} days.")
+    return consultations, files
+
+def start_archiver(mongo, upload_folder):
+    """Runs the archival job in a daemon thread every ARCHIVE_INTERVAL_HOURS, if set."""
+    if ARCHIVE_INTERVAL_HOURS <= 0:
+        return None
+
+    def loop():
+        while True:
+            try:
+                run_archival(mongo, upload_folder)
+            except Exception:
+                import traceback
+                traceback.print_exc()
+            time.sleep(ARCHIVE_INTERVAL_HOURS * 3600)
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,282 @@
+"""Load test for the FastAPI auth, patient and consultation routes.
+
+Runs the app from app/main.py in-process against a local Mongo stand-in,
+seeds doctors, patients and consultations, then replays mixed traffic and
+reports throughput, latency percentiles and error rate per endpoint.
+
+Run from backend/:
+    python -m loadtest                                  # in-memory mongomock
+    python -m loadtest --mongo mongodb://localhost:27017
+    python -m loadtest --save-baseline                  # store this run as the baseline
+"""
+import argparse
+import asyncio
+import importlib.machinery
+import importlib.util
+import json
+import os
+import random
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUDIO_PATH = os.path.join(os.path.dirname(BACKEND_DIR), "audio", "speech.wav")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+PASSWORD = "loadtest-password"
+FIRST_NAMES = ["Asha", "Ravi", "Meera", "John", "Fatima", "Chen", "Maria", "Arjun", "Lena", "Omar"]
+LAST_NAMES = ["Nair", "Sharma", "Smith", "Khan", "Wang", "Garcia", "Menon", "Iyer", "Brown", "Ali"]
+
+# Relative weight of each endpoint in the replayed traffic
+TRAFFIC_MIX = {
+    "login": 10,
+    "list_patients": 35,
+    "search_patients": 30,
+    "create_consultation": 25,
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the clinical API")
+    parser.add_argument("--mongo", default="mongomock://",
+                        help="Mongo URI; mongomock:// runs fully in memory (default)")
+    parser.add_argument("--db", default="clinical_system_loadtest",
+                        help="Database name; it is wiped before seeding")
+    parser.add_argument("--doctors", type=int, default=20)
+    parser.add_argument("--patients-per-doctor", type=int, default=50)
+    parser.add_argument("--consultations-per-patient", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of traffic")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative drop in rps / rise in p95 before flagging")
+    return parser.parse_args()
+
+
+async def seed(args, rng):
+    from app.database import doctor_collection, patient_collection, consultation_collection
+    from app.auth import get_password_hash
+    from datetime import datetime, timedelta
+
+    for collection in (doctor_collection, patient_collection, consultation_collection):
+        await collection.delete_many({})
+
+    # Hash once; bcrypt per doctor would dominate seeding time
+    hashed = get_password_hash(PASSWORD)
+    doctors = [
+        {"name": f"Dr. {rng.choice(LAST_NAMES)}", "username": f"doctor{i}", "password": hashed}
+        for i in range(args.doctors)
+    ]
+    result = await doctor_collection.insert_many(doctors)
+    doctor_ids = [str(_id) for _id in result.inserted_ids]
+
+    patients = []
+    for doctor_id in doctor_ids:
+        for _ in range(args.patients_per_doctor):
+            patients.append({
+                "doctor_id": doctor_id,
+                "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                "age": rng.randint(1, 95),
+                "gender": rng.choice(["Male", "Female"]),
+                "contact": f"9{rng.randint(100000000, 999999999)}",
+                "medical_history": rng.choice(["", "Hypertension", "Type 2 diabetes", "Asthma"]),
+            })
+    patient_ids = {doctor_id: [] for doctor_id in doctor_ids}
+    if patients:
+        result = await patient_collection.insert_many(patients)
+        for patient, _id in zip(patients, result.inserted_ids):
+            patient_ids[patient["doctor_id"]].append(str(_id))
+
+    consultations = []
+    now = datetime.utcnow()
+    for doctor_id, ids in patient_ids.items():
+        for patient_id in ids:
+            for _ in range(args.consultations_per_patient):
+                consultations.append({
+                    "patient_id": patient_id,
+                    "doctor_id": doctor_id,
+                    "date": now - timedelta(days=rng.randint(0, 1000)),
+                    "transcription_text": "Patient reports mild headache and fatigue for three days. " * 4,
+                    "prescription_notes": "Paracetamol 500mg twice daily",
+                })
+    if consultations:
+        await consultation_collection.insert_many(consultations)
+
+    print(f"Seeded {len(doctors)} doctors, {len(patients)} patients, {len(consultations)} consultations")
+    return doctor_ids, patient_ids
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = {name: [] for name in TRAFFIC_MIX}
+        self.errors = {name: 0 for name in TRAFFIC_MIX}
+
+    def record(self, name, latency, ok):
+        self.latencies[name].append(latency)
+        if not ok:
+            self.errors[name] += 1
+
+    def summary(self, elapsed):
+        report = {}
+        for name, samples in self.latencies.items():
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            report[name] = {
+                "requests": len(ordered),
+                "rps": round(len(ordered) / elapsed, 2),
+                "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+                "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+                "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+                "error_rate": round(self.errors[name] / len(ordered), 4),
+            }
+        return report
+
+
+def register_api_package():
+    """Makes `import app` resolve to the FastAPI package rather than the Flask app.py.
+
+    app/ has no __init__.py, so as a namespace package it loses to app.py
+    sitting next to it on sys.path.
+    """
+    spec = importlib.machinery.ModuleSpec("app", None, is_package=True)
+    spec.submodule_search_locations = [os.path.join(BACKEND_DIR, "app")]
+    sys.modules["app"] = importlib.util.module_from_spec(spec)
+
+
+def percentile(ordered, pct):
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def login(client, username):
+    return await client.post("/auth/login", data={"username": username, "password": PASSWORD})
+
+
+async def run_traffic(args, rng, doctor_ids, patient_ids, audio):
+    import httpx
+    from app.main import app
+
+    stats = Stats()
+    usernames = [f"doctor{i}" for i in range(args.doctors)]
+    names, weights = zip(*TRAFFIC_MIX.items())
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+        # Token per doctor up front so non-login traffic does not pay for bcrypt
+        tokens = []
+        for username in usernames:
+            response = await login(client, username)
+            response.raise_for_status()
+            tokens.append(response.json()["access_token"])
+
+        async def request(name):
+            index = rng.randrange(len(doctor_ids))
+            doctor_id = doctor_ids[index]
+            headers = {"Authorization": f"Bearer {tokens[index]}"}
+            if name == "login":
+                return await login(client, usernames[index])
+            if name == "list_patients":
+                return await client.get("/patients/", headers=headers)
+            if name == "search_patients":
+                params = {"search": rng.choice(FIRST_NAMES + LAST_NAMES)[:3]}
+                return await client.get("/patients/", params=params, headers=headers)
+            return await client.post(
+                "/consultations/",
+                headers=headers,
+                data={
+                    "patient_id": rng.choice(patient_ids[doctor_id]),
+                    "prescription_notes": "Rest and fluids",
+                },
+                files={"audio": ("speech.wav", audio, "audio/wav")},
+            )
+
+        async def worker(deadline):
+            while time.perf_counter() < deadline:
+                name = rng.choices(names, weights)[0]
+                started = time.perf_counter()
+                try:
+                    response = await request(name)
+                    ok = response.status_code < 400
+                except Exception:
+                    ok = False
+                stats.record(name, time.perf_counter() - started, ok)
+
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(worker(deadline) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return stats.summary(elapsed)
+
+
+def print_report(report):
+    header = f"{'endpoint':<22}{'requests':>10}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, row in report.items():
+        print(f"{name:<22}{row['requests']:>10}{row['rps']:>10}{row['p50_ms']:>10}"
+              f"{row['p95_ms']:>10}{row['p99_ms']:>10}{row['error_rate']:>9.2%}")
+
+
+def find_regressions(report, baseline, tolerance):
+    regressions = []
+    for name, base in baseline.items():
+        row = report.get(name)
+        if row is None:
+            regressions.append(f"{name}: no requests recorded")
+            continue
+        if row["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: rps {row['rps']} < baseline {base['rps']}")
+        if row["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {row['p95_ms']}ms > baseline {base['p95_ms']}ms")
+        if row["error_rate"] > base["error_rate"] + 0.01:
+            regressions.append(f"{name}: error rate {row['error_rate']:.2%} > baseline {base['error_rate']:.2%}")
+    return regressions
+
+
+def main():
+    args = parse_args()
+    # The app reads its Mongo settings at import time
+    os.environ["MONGO_DETAILS"] = args.mongo
+    os.environ["MONGO_DB"] = args.db
+    register_api_package()
+
+    with open(AUDIO_PATH, "rb") as f:
+        audio = f.read()
+
+    rng = random.Random(args.seed)
+
+    async def run():
+        doctor_ids, patient_ids = await seed(args, rng)
+        return await run_traffic(args, rng, doctor_ids, patient_ids, audio)
+
+    report = asyncio.run(run())
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline found; run with --save-baseline to create one.")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = find_regressions(report, baseline, args.tolerance)
+    if regressions:
+        print("REGRESSIONS:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print("No regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
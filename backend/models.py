@@ -3,6 +3,7 @@ from pymongo import MongoClient
 from bson.objectid import ObjectId
 from datetime import datetime
 import uuid
+import archive
 
 class Doctor(UserMixin):
     def __init__(self, user_data):
@@ -56,6 +57,8 @@ class Patient:
                         updated = True
                 if updated:
                      mongo.db.patients.update_one({"_id": ObjectId(patient_id)}, {"$set": {"consultations": patient['consultations']}})
+                # After the backfill above, so rehydrated records are never written back to hot storage
+                patient['consultations'] = archive.rehydrate(patient['consultations'])
             return patient
         except:
             return None
@@ -79,11 +82,64 @@ class Patient:
 
     @staticmethod
     def delete_consultation(mongo, patient_id, consultation_id):
+        patient = mongo.db.patients.find_one(
+            {"_id": ObjectId(patient_id)},
+            {"consultations": {"$elemMatch": {"id": consultation_id}}}
+        )
+        # An archived consultation's data lives in cold storage, not in the stub.
+        # Purge it first: if that fails the stub stays, so the delete can be retried
+        if patient and patient.get('consultations') and patient['consultations'][0].get('archived'):
+            archive.delete_record(patient['consultations'][0])
         return mongo.db.patients.update_one(
             {"_id": ObjectId(patient_id)},
             {"$pull": {"consultations": {"id": consultation_id}}}
         )
 
+    @staticmethod
+    def get_file(mongo, patient_id, filename):
+        patient = mongo.db.patients.find_one(
+            {"_id": ObjectId(patient_id)},
+            {"files": {"$elemMatch": {"filename": filename}}}
+        )
+        if patient and patient.get('files'):
+            return patient['files'][0]
+        return None
+
+    @staticmethod
+    def get_consultation(mongo, patient_id, consultation_id):
+        patient = mongo.db.patients.find_one(
+            {"_id": ObjectId(patient_id)},
+            {"consultations": {"$elemMatch": {"id": consultation_id}}}
+        )
+        if patient and patient.get('consultations'):
+            return archive.rehydrate(patient['consultations'])[0]
+        return None
+
+    @staticmethod
+    def update_consultation(mongo, patient_id, consultation_id, data, match=None):
+        # `match` adds conditions on the consultation itself, e.g. its current status
+        return mongo.db.patients.update_one(
+            {"_id": ObjectId(patient_id), "consultations": {"$elemMatch": {"id": consultation_id, **(match or {})}}},
+            {"$set": {f"consultations.$.{k}": v for k, v in data.items()}}
+        )
+
+    @staticmethod
+    def fail_stale_drafts(mongo, started_before, error):
+        # The positional operator updates one matching element per document, so repeat until none are left
+        stale = {"$elemMatch": {"transcription.status": "draft", "date": {"$lt": started_before}}}
+        failed = 0
+        while True:
+            result = mongo.db.patients.update_many(
+                {"consultations": stale},
+                {"$set": {
+                    "consultations.$.transcription.status": "failed",
+                    "consultations.$.transcription.error": error,
+                }}
+            )
+            if not result.modified_count:
+                return failed
+            failed += result.modified_count
+
     @staticmethod
     def add_file(mongo, patient_id, file_data):
         return mongo.db.patients.update_one(